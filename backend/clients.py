@@ -0,0 +1,47 @@
+"""
+backend/clients.py
+
+Shared HTTP and Azure OpenAI clients, built once per process. Every caller
+reuses the same keep-alive connection pool instead of paying a TLS handshake
+per client, and the async OpenAI client keeps request-path LLM calls on the
+event loop instead of parking a worker thread per call.
+"""
+
+import os
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncAzureOpenAI, AzureOpenAI
+
+load_dotenv()
+
+API_VERSION = "2025-03-01-preview"
+
+# One pooled async transport shared by the raw REST calls (Whisper/TTS) and
+# the async OpenAI client below.
+http_client = httpx.AsyncClient(
+    timeout=60,
+    limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+)
+
+# Async client for request-path chat completions.
+async_openai = AsyncAzureOpenAI(
+    api_version=API_VERSION,
+    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+    http_client=http_client,
+)
+
+# Sync client for code that already runs in worker threads (e.g. the history
+# folding summarizer called via asyncio.to_thread).
+openai_client = AzureOpenAI(
+    api_version=API_VERSION,
+    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+)
+
+
+async def aclose():
+    """Close the shared clients; call once at application shutdown."""
+    await async_openai.close()
+    await http_client.aclose()
@@ -1,6 +1,9 @@
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
-from azure.cosmos import CosmosClient, PartitionKey
+from azure.cosmos import PartitionKey, exceptions
+from azure.cosmos.aio import CosmosClient
 from datetime import datetime
 
 load_dotenv()
@@ -8,45 +11,164 @@ load_dotenv()
 COSMOS_CONN_STR = os.getenv("COSMO_DB_CONNECTION_STRING")
 COSMOS_DB_NAME = os.getenv("COSMO_DB_NAME", "talk2data")
 COSMOS_CONTAINER_NAME = os.getenv("COSMO_DB_CONTAINER", "conversations")
+# Comma-separated list of regions to read from, nearest first (e.g. "East US,West US")
+COSMOS_PREFERRED_LOCATIONS = [
+    region.strip()
+    for region in os.getenv("COSMO_DB_PREFERRED_REGIONS", "").split(",")
+    if region.strip()
+]
 
-client = CosmosClient.from_connection_string(COSMOS_CONN_STR)
-database = client.create_database_if_not_exists(id=COSMOS_DB_NAME)
-container = database.create_container_if_not_exists(
-    id=COSMOS_CONTAINER_NAME,
-    partition_key=PartitionKey(path="/sessionID")
+# Single long-lived async client for the whole process so Cosmos I/O no longer
+# blocks the FastAPI event loop. The Python SDK only supports Gateway mode, so
+# the latency levers here are pinning preferred regions and session consistency
+# so reads stay in-region.
+client = CosmosClient.from_connection_string(
+    COSMOS_CONN_STR,
+    preferred_locations=COSMOS_PREFERRED_LOCATIONS or None,
+    consistency_level="Session",
 )
+_container = None
 
-def add_request_response(session_id, request_text, response_text, request_time=None, response_time=None):
-    """Add a request/response pair to the session in CosmosDB."""
+
+async def _get_container():
+    """Lazily create the database/container handles on first use."""
+    global _container
+    if _container is None:
+        database = await client.create_database_if_not_exists(id=COSMOS_DB_NAME)
+        _container = await database.create_container_if_not_exists(
+            id=COSMOS_CONTAINER_NAME,
+            partition_key=PartitionKey(path="/sessionID")
+        )
+    return _container
+
+# Sliding-window history: once the raw turn lists exceed this rough token
+# budget (~4 chars/token), the oldest turns are folded into the session's
+# running "summary" field at write time so the read path stays bounded no
+# matter how long the session runs.
+MAX_HISTORY_TOKENS = int(os.getenv("COSMO_DB_MAX_HISTORY_TOKENS", "8000"))
+RECENT_TURNS_KEPT = 10
+
+# In-process TTL cache of session documents so hot sessions skip the Cosmos
+# read on every turn. Cosmos remains the source of truth; the cache is
+# per-process only and refreshed on every write.
+_SESSION_CACHE = {}
+_SESSION_CACHE_TTL = 60  # seconds
+_SESSION_CACHE_MAX = 1024
+
+
+def _cached_session(session_id):
+    entry = _SESSION_CACHE.get(session_id)
+    if entry is not None:
+        cached_at, session = entry
+        if time.monotonic() - cached_at < _SESSION_CACHE_TTL:
+            return session
+        del _SESSION_CACHE[session_id]
+    return None
+
+
+def _cache_session(session_id, session):
+    if len(_SESSION_CACHE) >= _SESSION_CACHE_MAX:
+        # Drop the oldest entry (dicts preserve insertion order).
+        _SESSION_CACHE.pop(next(iter(_SESSION_CACHE)))
+    _SESSION_CACHE[session_id] = (time.monotonic(), session)
+
+
+def _history_tokens(session):
+    """Rough token estimate (~4 chars/token) for the stored raw turns."""
+    chars = sum(len(entry["text"]) for entry in session.get("request", []))
+    chars += sum(len(entry["text"]) for entry in session.get("response", []))
+    return chars // 4
+
+
+def _fold_history(session, summarize):
+    """Fold all but the most recent turns into the session's running summary."""
+    reqs = session.get("request", [])
+    resps = session.get("response", [])
+    if len(reqs) <= RECENT_TURNS_KEPT:
+        return
+    transcript = "\n".join(
+        f"User: {q['text']}\nAssistant: {a['text']}"
+        for q, a in zip(reqs[:-RECENT_TURNS_KEPT], resps[:-RECENT_TURNS_KEPT])
+    )
+    session["summary"] = summarize(session.get("summary", ""), transcript)
+    session["request"] = reqs[-RECENT_TURNS_KEPT:]
+    session["response"] = resps[-RECENT_TURNS_KEPT:]
+
+
+async def add_request_response(session_id, request_text, response_text, request_time=None, response_time=None, summarize=None):
+    """Add a request/response pair to the session in CosmosDB.
+
+    When `summarize` is provided (callable taking the previous summary and a
+    transcript of the turns being dropped), oversized histories are folded
+    into the session's `summary` field here, at write time, so the read path
+    never pays for summarization.
+    """
     request_time = request_time or datetime.utcnow().strftime("%H:%M:%S UTC")
     response_time = response_time or datetime.utcnow().strftime("%H:%M:%S UTC")
-    # Try to fetch the session doc
-    session = get_session(session_id)
+    request_entry = {"text": request_text, "time": request_time}
+    response_entry = {"text": response_text, "time": response_time}
+    container = await _get_container()
+    # Try the cache first, then fall back to a Cosmos read
+    session = _cached_session(session_id)
+    if session is None:
+        session = await get_session(session_id)
     if session is None:
         session = {
             "id": session_id,
             "sessionID": session_id,
-            "request": [],
-            "response": []
+            "request": [request_entry],
+            "response": [response_entry]
         }
-    session["request"].append({"text": request_text, "time": request_time})
-    session["response"].append({"text": response_text, "time": response_time})
-    container.upsert_item(session)
+        await container.create_item(session)
+        _cache_session(session_id, session)
+        return
+    session["request"].append(request_entry)
+    session["response"].append(response_entry)
+    if summarize is not None and _history_tokens(session) > MAX_HISTORY_TOKENS:
+        # The summarizer is a sync LLM call, so keep it off the event loop.
+        # Folding rewrites the turn lists, so the whole doc must be re-sent.
+        await asyncio.to_thread(_fold_history, session, summarize)
+        await container.upsert_item(session)
+    else:
+        # O(1) append: ship only the new pair instead of re-sending the whole
+        # document, whose size grows with every prior turn.
+        await container.patch_item(
+            item=session_id,
+            partition_key=session_id,
+            patch_operations=[
+                {"op": "add", "path": "/request/-", "value": request_entry},
+                {"op": "add", "path": "/response/-", "value": response_entry},
+            ],
+        )
+    _cache_session(session_id, session)
 
 
-def get_last_n_pairs(session_id, n=10):
+async def get_last_n_pairs(session_id, n=10):
     """Get the last n request/response pairs for a session."""
-    session = get_session(session_id)
+    _, pairs = await get_history_context(session_id, n=n)
+    return pairs
+
+
+async def get_history_context(session_id, n=10):
+    """Get the running summary and the last n request/response pairs for a session."""
+    session = _cached_session(session_id)
+    if session is None:
+        session = await get_session(session_id)
+        if session is not None:
+            _cache_session(session_id, session)
     if session is None:
-        return []
+        return "", []
     reqs = session.get("request", [])[-n:]
     resps = session.get("response", [])[-n:]
-    return list(zip(reqs, resps))
+    return session.get("summary", ""), list(zip(reqs, resps))
 
 
-def get_session(session_id):
-    """Fetch the session document by sessionID."""
-    query = f"SELECT * FROM c WHERE c.sessionID = @sessionID"
-    params = [{"name": "@sessionID", "value": session_id}]
-    items = list(container.query_items(query=query, parameters=params, enable_cross_partition_query=True))
-    return items[0] if items else None 
\ No newline at end of file
+async def get_session(session_id):
+    """Fetch the session document with a single-partition point read."""
+    # Documents use id == sessionID, so a point read replaces the old
+    # cross-partition query (O(1) RU instead of a fan-out across partitions).
+    container = await _get_container()
+    try:
+        return await container.read_item(item=session_id, partition_key=session_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return None 
\ No newline at end of file
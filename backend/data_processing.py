@@ -1,118 +1,186 @@
+import asyncio
+import logging
 import os
 from dotenv import load_dotenv
-from openai import AzureOpenAI
-from cosmodb_manager import get_last_n_pairs
+from clients import async_openai, openai_client
+from cosmodb_manager import get_history_context
 import sys
-import importlib.util
 import re
+import tiktoken
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-# Dynamically import query_engine.py from data_2_phone/preprocessing
-QUERY_ENGINE_PATH = os.path.join(os.path.dirname(__file__), '../data_2_phone/preprocessing/query_engine.py')
-spec = importlib.util.spec_from_file_location("query_engine", QUERY_ENGINE_PATH)
-query_engine = importlib.util.module_from_spec(spec)
-sys.modules["query_engine"] = query_engine
-spec.loader.exec_module(query_engine)
+from data_2_phone.preprocessing import query_engine
 
-# Azure OpenAI config
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
+# Azure OpenAI config (clients live in clients.py so every module shares one
+# connection pool)
 AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
-API_VERSION = "2025-03-01-preview"
 
-# Prompt template for summary
-DEFAULT_PROMPT = (
+# Static instructions live in the system message so the prompt prefix is
+# byte-identical across turns and Azure OpenAI's prompt cache can hit;
+# only the per-turn content goes into the user message below.
+SUMMARY_SYSTEM_PROMPT = (
+    "You are a helpful assistant that summarizes SQL answers for users. "
     "Given the following conversation history, user query, generated SQL, and SQL answer, "
-    "generate a helpful, spoken summary for the user.\n\n"
+    "generate a helpful, spoken summary for the user."
+)
+
+# Prompt template for the dynamic (per-turn) part of the summary prompt
+DEFAULT_PROMPT = (
     "Conversation History:\n{{conversation_history}}\n\n"
     "User Query:\n{{user_query}}\n\n"
     "Generated SQL:\n{{sql}}\n\n"
     "SQL Answer:\n{{answer}}"
 )
 
+# Resolved once at import time (.env is loaded above). Re-parsing .env on
+# every request was a disk read per turn and made the prompt prefix unstable.
+# Restart the process to pick up template changes.
+# Templates use {{double-brace}} placeholders (a leftover from the old
+# re.sub-based substitution); normalize to single-brace once here so
+# str.format fills them in a single linear pass.
+PROMPT_TEMPLATE = (
+    os.getenv("SPOKEN_ANSWER_SUMMARY_GENERATION_PROMPT", DEFAULT_PROMPT)
+    .replace("{{", "{")
+    .replace("}}", "}")
+)
+
 MAX_PROMPT_TOKENS = 1_000_000
 
+# o200k_base is the encoding used by the gpt-4o family deployments this
+# backend targets; loaded once per process.
+_ENCODER = tiktoken.get_encoding("o200k_base")
+
 def estimate_tokens(text):
-    return len(text) // 4
+    """Count tokens with the model's real tokenizer instead of chars//4."""
+    return len(_ENCODER.encode(text, disallowed_special=()))
 
-# Initialize OpenAI client
-client = AzureOpenAI(
-    api_version=API_VERSION,
-    azure_endpoint=AZURE_OPENAI_ENDPOINT,
-    api_key=AZURE_OPENAI_API_KEY,
+# Token cost of the template scaffolding itself, measured once at import.
+_TEMPLATE_OVERHEAD_TOKENS = estimate_tokens(
+    PROMPT_TEMPLATE.format(conversation_history="", user_query="", sql="", answer="")
 )
 
-def get_summary_response(user_query, session_id):
+def summarize_history(previous_summary, transcript):
+    """Merge older conversation turns into a short running summary.
+
+    Passed to cosmodb_manager.add_request_response so oversized histories are
+    folded at write time rather than on the read hot path. Uses the sync
+    client because folding already runs in a worker thread.
+    """
+    response = openai_client.chat.completions.create(
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "You maintain a concise running summary of a conversation. "
+                    "Merge the existing summary and the older turns below into a short "
+                    "summary that preserves facts, entities, and user preferences."
+                ),
+            },
+            {
+                "role": "user",
+                "content": (
+                    f"Existing summary:\n{previous_summary or '(none)'}\n\n"
+                    f"Older turns to fold in:\n{transcript}"
+                ),
+            },
+        ],
+        model=AZURE_OPENAI_DEPLOYMENT_NAME,
+        temperature=0.2,
+        top_p=1.0
+    )
+    return response.choices[0].message.content
+
+
+async def get_summary_response(user_query, session_id, history=None):
     """
     1. Use query_engine to get SQL and SQL answer for the user query.
     2. Retrieve last 10 Q&A pairs from CosmosDB.
     3. Build prompt with all context.
     4. Call Azure OpenAI to get summary response.
     5. Return summary response (text).
-    """
-    # Step 1: Get SQL and SQL answer
-    sql, sql_answer = query_engine.get_sql_and_answer(user_query)
 
-    # Step 2: Get last 10 Q&A pairs
-    history_pairs = get_last_n_pairs(session_id, n=10)
+    Callers that already hold the session history can pass it as
+    ``history=(summary, pairs)`` to skip the Cosmos round trip; the write
+    path further dedupes via the TTL session cache in cosmodb_manager.
+    """
+    # Steps 1+2 are independent, so run the SQL generation (sync LLM + SQLite
+    # work, off the event loop) concurrently with the Cosmos history fetch.
+    sql_task = asyncio.create_task(
+        asyncio.to_thread(query_engine.get_sql_and_answer, user_query)
+    )
+    if history is None:
+        history = await get_history_context(session_id, n=10)
+    sql, sql_answer = await sql_task
+    history_summary, history_pairs = history
     history_str = "\n".join([
         f"User: {q['text']}\nAssistant: {a['text']}" for q, a in history_pairs
     ])
+    if history_summary:
+        history_str = f"Summary of earlier conversation:\n{history_summary}\n\n{history_str}"
+
+    # Step 3: Budget the prompt from its component token counts, so even the
+    # truncation path never formats (and so copies) the full prompt more
+    # than once.
+    overhead_tokens = (
+        _TEMPLATE_OVERHEAD_TOKENS
+        + estimate_tokens(user_query)
+        + estimate_tokens(sql)
+    )
+    if overhead_tokens + estimate_tokens(history_str) + estimate_tokens(sql_answer) > MAX_PROMPT_TOKENS:
+        # Drop the conversation history first
+        history_str = ""
+        if overhead_tokens + estimate_tokens(sql_answer) > MAX_PROMPT_TOKENS:
+            # Then cut the SQL answer at an exact token boundary so the
+            # final prompt lands on the budget instead of a chars//4 guess
+            answer_budget = max(MAX_PROMPT_TOKENS - overhead_tokens, 0)
+            answer_tokens = _ENCODER.encode(sql_answer, disallowed_special=())
+            sql_answer = _ENCODER.decode(answer_tokens[:answer_budget])
 
-    # Step 3: Always reload .env and fetch prompt template
-    load_dotenv(override=True)
-    prompt_template = os.getenv("SPOKEN_ANSWER_SUMMARY_GENERATION_PROMPT", DEFAULT_PROMPT)
     # Use str.format for prompt substitution to avoid regex escape issues
-    prompt = prompt_template.format(
+    prompt = PROMPT_TEMPLATE.format(
         conversation_history=history_str,
         user_query=user_query,
         sql=sql,
         answer=sql_answer
     )
 
-    if estimate_tokens(prompt) > MAX_PROMPT_TOKENS:
-        # Remove conversation history
-        prompt = prompt_template.format(
-            conversation_history="",
-            user_query=user_query,
-            sql=sql,
-            answer=sql_answer
-        )
-    if estimate_tokens(prompt) > MAX_PROMPT_TOKENS:
-        # Truncate SQL answer if still too long
-        allowed_answer_len = MAX_PROMPT_TOKENS * 4 - len(prompt_template.format(
-            conversation_history="",
-            user_query=user_query,
-            sql=sql,
-            answer=""
-        ))
-        truncated_answer = sql_answer[:allowed_answer_len]
-        prompt = prompt_template.format(
-            conversation_history="",
-            user_query=user_query,
-            sql=sql,
-            answer=truncated_answer
-        )
-
-    # Write the final prompt to a file for debugging
-    prompt_path = os.path.join(os.path.dirname(__file__), "prompt.txt")
-    with open(prompt_path, "w", encoding="utf-8") as f:
-        f.write(prompt)
-
-    # Step 4: Call LLM
-    response = client.chat.completions.create(
+    # Log the final prompt only when debug logging is enabled; the old
+    # unconditional prompt.txt write was a blocking disk write per request
+    # that concurrent workers would clobber.
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Final summary prompt:\n%s", prompt)
+
+    # Step 4: Call LLM (async client, so the event loop stays free)
+    summary = await _stream_summary_completion(prompt)
+    return summary
+
+
+async def _stream_summary_completion(prompt):
+    """Stream the summary completion and accumulate the chunks.
+
+    Streaming starts receiving tokens as soon as generation begins instead of
+    waiting for the full response; the endpoint still returns the assembled
+    text because the JSON + TTS contract needs the complete summary.
+    """
+    stream = await async_openai.chat.completions.create(
         messages=[
-            {"role": "system", "content": "You are a helpful assistant that summarizes SQL answers for users."},
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ],
         model=AZURE_OPENAI_DEPLOYMENT_NAME,
         temperature=0.7,
-        top_p=1.0
+        top_p=1.0,
+        stream=True
     )
-    summary = response.choices[0].message.content
-    return summary 
\ No newline at end of file
+    parts = []
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+    return "".join(parts)
\ No newline at end of file
@@ -13,21 +13,19 @@ Environment variables are loaded from a .env file. The backend is designed to wo
 
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from openai import AzureOpenAI
 from dotenv import load_dotenv
+import asyncio
+import base64
+import heapq
+import itertools
 import os
-import tempfile
 import logging
-import azure.cognitiveservices.speech as speechsdk
-import json
-import wave
-import io
-import requests
 from datetime import datetime
-import shutil
-from data_processing import get_summary_response
+import clients
+from clients import http_client
+from data_processing import get_summary_response, summarize_history
 from cosmodb_manager import add_request_response
-import uuid
+import secrets
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -42,6 +40,27 @@ os.makedirs(TEMP_DIR, exist_ok=True)
 
 app = FastAPI()
 
+# Cosmos writes scheduled off the response path; strong refs keep the tasks
+# alive until done, and shutdown drains them before closing clients.
+_background_writes = set()
+
+
+def _on_write_done(task):
+    _background_writes.discard(task)
+    # Surface failures here — nothing awaits these tasks, so an unlogged
+    # exception would silently drop the conversation turn
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background Cosmos write failed: {task.exception()!r}")
+
+
+# Whisper/TTS calls go through the shared pooled client from clients.py, so
+# they reuse the same TLS connections as the OpenAI SDK traffic.
+@app.on_event("shutdown")
+async def _close_clients():
+    if _background_writes:
+        await asyncio.gather(*_background_writes, return_exceptions=True)
+    await clients.aclose()
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -51,62 +70,50 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Azure OpenAI client for chat
-try:
-    chat_client = AzureOpenAI(
-        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-        api_version="2023-05-15",
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT").rstrip('/')  # Remove trailing slash
-    )
-    logger.info("Azure OpenAI client initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize Azure OpenAI client: {str(e)}")
-    raise
-
-# Initialize Speech Config for TTS only
-try:
-    tts_key = os.getenv("AZURE_OPENAI_TTS_API_KEY")
-    if not tts_key:
-        raise ValueError("AZURE_OPENAI_TTS_API_KEY is not set in environment variables")
-    
-    tts_config = speechsdk.SpeechConfig(
-        subscription=tts_key,
-        region="swedencentral"  # TTS Medical region
-    )
-    tts_config.speech_synthesis_voice_name = os.getenv("AZURE_OPENAI_TTS_DEPLOYMENT_NAME")
-    logger.info("TTS config initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize TTS config: {str(e)}")
-    raise
-
 logging.getLogger("azure.core.pipeline.policies.http_logging_policy").setLevel(logging.WARNING)
 
+# Prune the temp directory every N writes rather than on each one; the scan
+# plus unlinks are O(dir size) and the 10-file cap only needs to hold
+# approximately.
+_CLEANUP_EVERY = 20
+_write_counter = itertools.count(1)
+
+
 def save_to_temp(content, prefix, extension):
     """Save content to a file in the temp directory with timestamp and maintain only last 10 files"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"{prefix}_{timestamp}.{extension}"
     filepath = os.path.join(TEMP_DIR, filename)
-    
+
     with open(filepath, 'wb' if isinstance(content, bytes) else 'w') as f:
         f.write(content)
-    
-    # Clean up old files, keeping only the last 10
-    pattern = f"{prefix}_*.{extension}"
-    files = sorted(
-        [f for f in os.listdir(TEMP_DIR) if f.startswith(f"{prefix}_") and f.endswith(f".{extension}")],
-        key=lambda x: os.path.getmtime(os.path.join(TEMP_DIR, x)),
-        reverse=True
-    )
-    
+
+    if next(_write_counter) % _CLEANUP_EVERY == 0:
+        _cleanup_temp(prefix, extension)
+
+    return filepath
+
+
+def _cleanup_temp(prefix, extension):
+    """Remove all but the 10 newest files matching prefix/extension."""
+    # One scandir pass (mtime comes cached on the DirEntry) plus a bounded
+    # heap selection replaces listdir + a stat syscall per file + a full sort.
+    with os.scandir(TEMP_DIR) as it:
+        entries = [
+            entry for entry in it
+            if entry.name.startswith(f"{prefix}_") and entry.name.endswith(f".{extension}")
+        ]
+    keep = {entry.name for entry in heapq.nlargest(10, entries, key=lambda e: e.stat().st_mtime)}
+
     # Remove files beyond the last 10
-    for old_file in files[10:]:
+    for entry in entries:
+        if entry.name in keep:
+            continue
         try:
-            os.remove(os.path.join(TEMP_DIR, old_file))
-            logger.info(f"Removed old file: {old_file}")
+            os.remove(entry.path)
+            logger.info(f"Removed old file: {entry.name}")
         except Exception as e:
-            logger.error(f"Error removing old file {old_file}: {str(e)}")
-    
-    return filepath
+            logger.error(f"Error removing old file {entry.name}: {str(e)}")
 
 @app.post("/api/chat")
 async def chat(audio: UploadFile = File(...), session_id: str = None):
@@ -115,14 +122,10 @@ async def chat(audio: UploadFile = File(...), session_id: str = None):
         logger.info("Received audio file for processing")
         # Read the uploaded audio file
         content = await audio.read()
-        # Save original audio
-        original_audio_path = save_to_temp(content, "original_audio", "wav")
+        # Save original audio (in a thread so the disk write doesn't block
+        # the event loop)
+        original_audio_path = await asyncio.to_thread(save_to_temp, content, "original_audio", "wav")
         logger.info(f"Saved original audio to: {original_audio_path}")
-        # Save the upload exactly as-is
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            tmp.write(content)
-            temp_audio_path = tmp.name
-        logger.info(f"Saved audio file to: {temp_audio_path}")
         try:
             # Transcribe audio using Azure OpenAI Whisper
             whisper_url = (
@@ -133,36 +136,42 @@ async def chat(audio: UploadFile = File(...), session_id: str = None):
                 "api-key": os.getenv("AZURE_OPENAI_SPEECH_API_KEY")
             }
             logger.info("Attempting to transcribe audio with Whisper")
-            with open(temp_audio_path, 'rb') as audio_file:
-                files = {
-                    "file": ("audio.wav", audio_file, "audio/wav")
-                }
-                data = {
-                    "model": "whisper",
-                    "response_format": "text"
-                }
-                response = requests.post(
-                    whisper_url,
-                    headers=headers,
-                    files=files,
-                    data=data,
-                    timeout=60
-                )
+            # Post the uploaded bytes directly; the old tempfile write+reopen
+            # made two extra copies of the audio per request.
+            files = {
+                "file": ("audio.wav", content, "audio/wav")
+            }
+            data = {
+                "model": "whisper",
+                "response_format": "text"
+            }
+            response = await http_client.post(
+                whisper_url,
+                headers=headers,
+                files=files,
+                data=data
+            )
             if response.status_code == 200:
                 transcription = response.text
-                transcription_path = save_to_temp(transcription, "transcription", "txt")
+                transcription_path = await asyncio.to_thread(save_to_temp, transcription, "transcription", "txt")
                 logger.info(f"Saved transcription to: {transcription_path}")
                 logger.info(f"Transcription successful: {transcription}")
             else:
                 logger.error(f"Transcription failed with status {response.status_code}: {response.text}")
                 raise Exception(f"Transcription failed: {response.text}")
-            # Generate or use provided session_id
-            if not session_id:
-                session_id = str(uuid.uuid4())
+            # Generate or use provided session_id. token_urlsafe is a
+            # cheaper opaque id than uuid4 (one short urandom read, no
+            # UUID object construction/formatting).
+            session_id = session_id or secrets.token_urlsafe(12)
             # Get summary response from data_processing
-            summary_response = get_summary_response(transcription, session_id)
-            # Store request/response in CosmosDB
-            add_request_response(session_id, transcription, summary_response)
+            summary_response = await get_summary_response(transcription, session_id)
+            # Store request/response in CosmosDB in the background — the
+            # client shouldn't wait on the history write before hearing TTS
+            write_task = asyncio.create_task(
+                add_request_response(session_id, transcription, summary_response, summarize=summarize_history)
+            )
+            _background_writes.add(write_task)
+            write_task.add_done_callback(_on_write_done)
             # TTS via AOAI TTS endpoint (use summary_response)
             tts_url = (
                 f"{os.getenv('AZURE_OPENAI_TTS_ENDPOINT').rstrip('/')}"
@@ -180,17 +189,14 @@ async def chat(audio: UploadFile = File(...), session_id: str = None):
                 "input": summary_response,
                 "speed": 1.3               # 0.25-4.0
             }
-            tts_response = requests.post(tts_url, headers=tts_headers, json=tts_payload, stream=True, timeout=60)
+            tts_response = await http_client.post(tts_url, headers=tts_headers, json=tts_payload)
             tts_response.raise_for_status()
             audio_data = tts_response.content
-            tts_audio_path = save_to_temp(audio_data, "tts_response", "wav")
-            # Clean up temporary files
-            os.unlink(temp_audio_path)
-            logger.info("Cleaned up temporary files")
+            tts_audio_path = await asyncio.to_thread(save_to_temp, audio_data, "tts_response", "wav")
             return {
                 "session_id": session_id,
                 "response": summary_response,
-                "audio": audio_data.hex(),
+                "audio": base64.b64encode(audio_data).decode(),
                 "transcription": transcription,
                 "files": {
                     "original_audio": original_audio_path,
@@ -200,8 +206,6 @@ async def chat(audio: UploadFile = File(...), session_id: str = None):
             }
         except Exception as e:
             logger.error(f"Error during processing: {str(e)}")
-            if os.path.exists(temp_audio_path):
-                os.unlink(temp_audio_path)
             raise
     except Exception as e:
         logger.error(f"Error in chat endpoint: {str(e)}")
@@ -1,10 +1,16 @@
+import asyncio
 import os
 import pandas as pd
 import json
-import time
 import re  # Import regex module for sanitizing filenames
+import httpx
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI, AzureOpenAI
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json works everywhere
+    orjson = None
 
 # Load environment variables
 load_dotenv()
@@ -20,33 +26,51 @@ API_VERSION = "2025-03-01-preview"
 EXCEL_FILE = "data_2_phone/data/PLMDashboardDataFeedFile-03212025.xlsx"
 OUTPUT_JSON = "data_2_phone/preprocessing/column_description.json"
 
-# Initialize Azure OpenAI client
+# Cap on in-flight summary calls: enough to overlap the per-column round-trip
+# latency while staying under Azure TPM/RPM limits.
+LLM_CONCURRENCY = 8
+
+# Initialize Azure OpenAI clients (sync for call_llm, async for the
+# concurrent column-summary pass), each on an explicit keep-alive pool so
+# successive calls reuse the same TLS sockets instead of re-handshaking.
 client = AzureOpenAI(
     api_version=API_VERSION,
     azure_endpoint=AZURE_OPENAI_ENDPOINT,
     api_key=AZURE_OPENAI_API_KEY,
+    http_client=httpx.Client(
+        limits=httpx.Limits(max_keepalive_connections=8, max_connections=16),
+        timeout=60.0,
+    ),
+)
+async_client = AsyncAzureOpenAI(
+    api_version=API_VERSION,
+    azure_endpoint=AZURE_OPENAI_ENDPOINT,
+    api_key=AZURE_OPENAI_API_KEY,
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(max_keepalive_connections=LLM_CONCURRENCY, max_connections=16),
+        timeout=60.0,
+    ),
 )
 
 def read_excel(file_path):
     """Read the Excel file into a Pandas DataFrame."""
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"Excel file not found at path: {file_path}")
-    return pd.read_excel(file_path)
-
-def truncate_input(unique_values, histogram):
-    """Truncate input to reduce size."""
-    max_items = 100  # Adjust as needed
-    truncated_values = unique_values[:max_items]
-    truncated_histogram = {k: histogram[k] for k in list(histogram)[:max_items]}
-    return truncated_values, truncated_histogram
-
-def generate_column_summary(column_name, column_data):
-    """Generate a summary for a column using the Azure OpenAI client with retry logic."""
-    unique_values = column_data.dropna().unique().tolist()
-    histogram = column_data.value_counts().to_dict()
-
-    # Truncate input to reduce size
-    truncated_values, truncated_histogram = truncate_input(unique_values, histogram)
+    try:
+        # Rust-based reader; much faster than openpyxl's pure-Python XML parse
+        return pd.read_excel(file_path, engine="calamine")
+    except (ImportError, ValueError):
+        # python-calamine not installed or pandas too old for the engine
+        return pd.read_excel(file_path)
+
+async def generate_column_summary(column_name, column_data):
+    """Generate a summary for a column using the async Azure OpenAI client with retry logic."""
+    # Top 100 values in one vectorized pass; the old unique().tolist() +
+    # value_counts().to_dict() walked the column twice and materialized
+    # every distinct value just to keep the first 100.
+    value_counts = column_data.value_counts(dropna=True).head(100)
+    truncated_values = value_counts.index.tolist()
+    truncated_histogram = value_counts.to_dict()
 
     # Prepare the prompt
     prompt = f"{COLUMN_DESCRIPTION_PROMPT}\n\nColumn Name: {column_name}\nUnique Values: {truncated_values}\nHistogram: {truncated_histogram}"
@@ -58,7 +82,7 @@ def generate_column_summary(column_name, column_data):
     for attempt in range(max_retries):
         try:
             # Query the LLM endpoint
-            response = client.chat.completions.create(
+            response = await async_client.chat.completions.create(
                 messages=[
                     {"role": "system", "content": "You are a helpful assistant."},
                     {"role": "user", "content": prompt}
@@ -75,7 +99,7 @@ def generate_column_summary(column_name, column_data):
         except Exception as e:
             if "429" in str(e):
                 print(f"Rate limit exceeded. Retrying in {retry_delay} seconds... (Attempt {attempt + 1}/{max_retries})")
-                time.sleep(retry_delay)
+                await asyncio.sleep(retry_delay)
                 retry_delay *= 2  # Exponential backoff
             else:
                 raise e  # Raise other exceptions immediately
@@ -83,51 +107,76 @@ def generate_column_summary(column_name, column_data):
     # If all retries fail, raise an exception
     raise Exception("Failed to generate column summary after multiple retries due to rate limit.")
 
+# Compiled once; runs per column. Note the class is negated — the old inline
+# pattern was missing the ^ and replaced the valid characters instead.
+_SANITIZE_RE = re.compile(r'[^\w\-\. ]')
+
+
 def sanitize_filename(column_name):
     """Sanitize column name to create a valid filename."""
-    return re.sub(r'[\w\-_\. ]', '_', column_name)
+    return _SANITIZE_RE.sub('_', column_name)
+
+def _dump_json(obj, path):
+    """Write pretty-printed JSON, via orjson (C-speed) when installed."""
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, "w") as f:
+            json.dump(obj, f, indent=4)
+
 
-def is_column_summary_done(column_name):
-    """Check if a column summary JSON file already exists."""
-    sanitized_column_name = sanitize_filename(column_name)
+def _write_column_summary(column, summary):
+    """Write one column summary to its JSON file; returns the path."""
+    sanitized_column_name = sanitize_filename(column)
     column_file = f"preprocessing/{sanitized_column_name}.json"
-    return os.path.exists(column_file)
+    _dump_json({column: summary}, column_file)
+    return column_file
 
-def process_columns(df):
-    """Process each column in the DataFrame and generate summaries."""
-    column_descriptions = {}
+
+async def _summarize_column(semaphore, column, column_data):
+    """Summarize one column under the concurrency cap and persist it."""
+    async with semaphore:
+        summary = await generate_column_summary(column, column_data)
+    # Disk write goes to a thread so it doesn't stall the other in-flight calls
+    column_file = await asyncio.to_thread(_write_column_summary, column, summary)
+    print(f"Summary for column '{column}' generated and stored in {column_file}.")  # Indicate completion
+    return column, summary
+
+
+async def _process_columns_async(df):
+    semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+    # One directory listing instead of an os.path.exists stat per column
+    try:
+        existing = set(os.listdir("preprocessing"))
+    except FileNotFoundError:
+        existing = set()
+    tasks = []
     for column in df.columns:
         # Skip columns that already have summaries
-        if is_column_summary_done(column):
+        if f"{sanitize_filename(column)}.json" in existing:
             print(f"Skipping column '{column}' as its summary already exists.")
             continue
 
         print(f"Processing column: {column}...")  # Indicate column processing start
+        tasks.append(_summarize_column(semaphore, column, df[column]))
 
-        # Generate summary for the column
-        summary = generate_column_summary(column, df[column])
-        column_descriptions[column] = summary
-
-        # Sanitize column name for filename
-        sanitized_column_name = sanitize_filename(column)
-        column_file = f"preprocessing/{sanitized_column_name}.json"
+    return dict(await asyncio.gather(*tasks))
 
-        # Write individual column summary to a JSON file
-        os.makedirs("preprocessing", exist_ok=True)
-        with open(column_file, "w") as f:
-            json.dump({column: summary}, f, indent=4)
 
-        print(f"Summary for column '{column}' generated and stored in {column_file}.")  # Indicate completion
-
-    return column_descriptions
+def process_columns(df):
+    """Process the DataFrame columns and generate summaries, overlapping the
+    per-column LLM round trips with bounded concurrency."""
+    os.makedirs("preprocessing", exist_ok=True)
+    return asyncio.run(_process_columns_async(df))
 
-def call_llm(prompt, temperature=0.0):
+def call_llm(prompt, temperature=0.0, system_prompt="You are a helpful assistant."):
     """General function to call the LLM with any prompt using Azure OpenAI client."""
     try:
         # Query the LLM endpoint using the existing Azure OpenAI client
         response = client.chat.completions.create(
             messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt}
             ],
             temperature=temperature,
@@ -151,8 +200,7 @@ def main():
 
         # Write the master JSON file with all column summaries
         os.makedirs(os.path.dirname(OUTPUT_JSON), exist_ok=True)
-        with open(OUTPUT_JSON, "w") as f:
-            json.dump(column_descriptions, f, indent=4)
+        _dump_json(column_descriptions, OUTPUT_JSON)
 
         print(f"Master JSON file with all column summaries stored in {OUTPUT_JSON}.")  # Indicate master file completion
 
@@ -1,76 +1,223 @@
 import os
 import json
 import glob
+import collections
+import functools
+import logging
 import sqlite3
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from data_2_phone.preprocessing.process_excel import call_llm
 
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json works everywhere
+    orjson = None
+
+try:
+    import sqlglot
+    from sqlglot import exp as _sqlglot_exp
+except ImportError:  # optional; validation is skipped without it
+    sqlglot = None
+
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Constants
 DB_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data", "database.sqlite"))
 TABLE_NAME = "applications"
 
+# SQL-extraction patterns, compiled once at import since they run on every
+# LLM response
+_SQL_BLOCK_RE = re.compile(r"```sql\s*(.*?)\s*```", re.DOTALL | re.IGNORECASE)
+# Fallback extraction as one alternation: a single scan of the response picks
+# up whichever delimiter style is present instead of re-scanning the whole
+# text once per pattern.
+_SQL_ANY_RE = re.compile(
+    r"```sql\s*(?P<block>.*?)\s*```|(?P<select>SELECT[\s\S]+?;)",
+    re.DOTALL | re.IGNORECASE,
+)
+
+# Cap on rows materialized per query — LLM-generated SQL can accidentally
+# select the whole table, and the answer is JSON-serialized into a prompt
+# downstream anyway.
+MAX_RESULT_ROWS = int(os.getenv("QUERY_ENGINE_MAX_ROWS", "10000"))
+
+_LIMIT_RE = re.compile(r"\bLIMIT\s+\d+", re.IGNORECASE)
+
+
+def _json_dumps(obj, sort_keys=False):
+    """Pretty-print obj as JSON, via orjson (C-speed) when installed."""
+    if orjson is not None:
+        option = orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, option=option).decode()
+    return json.dumps(obj, indent=2, sort_keys=sort_keys)
+
+# One read-only connection per thread, opened once and reused. Opening and
+# closing a connection per query paid file-open, lock and schema-parse
+# overhead on every request for this read-mostly workload.
+_local = threading.local()
+
+# Actions the generated SQL is allowed to perform: reads, SELECTs,
+# recursive CTEs, SQL functions and PRAGMA (needed for table_info).
+# Everything else — writes, DDL, ATTACH — is denied at the authorizer
+# level as a second wall behind the read-only connection.
+_READ_ACTIONS = frozenset((
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_RECURSIVE,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_PRAGMA,
+))
+
+
+def _read_only_authorizer(action, *args):
+    return sqlite3.SQLITE_OK if action in _READ_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def _get_conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        # cached_statements keeps parsed statements per SQL text, so repeat
+        # queries skip SQLite's parse/prepare step entirely
+        conn = sqlite3.connect(
+            f"file:{DB_FILE}?mode=ro", uri=True, check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.execute("PRAGMA query_only=1")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.set_authorizer(_read_only_authorizer)
+        _local.conn = conn
+    return conn
+
+
+def _is_single_statement(sql):
+    """True if sql is exactly one complete SQL statement."""
+    sql = sql.strip()
+    if not sql:
+        return False
+    if not sql.endswith(";"):
+        sql += ";"
+    if not sqlite3.complete_statement(sql):
+        return False
+    # A second statement means some proper prefix is already complete.
+    for i, ch in enumerate(sql[:-1]):
+        if ch == ";" and sqlite3.complete_statement(sql[: i + 1]):
+            return False
+    return True
+
+_DESCRIPTIONS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "column_summaries",
+    "formatted_output"
+)
+
+
+def _descriptions_mtime_sig():
+    """Signature of the formatted_output directory: file count + newest mtime.
+
+    A stat-only pass, so staleness checks cost microseconds while edits to
+    the description files still invalidate the memoized loads below.
+    """
+    paths = glob.glob(os.path.join(_DESCRIPTIONS_DIR, "*.json"))
+    return len(paths), max(map(os.path.getmtime, paths), default=0.0)
+
+
 def load_column_descriptions(max_tokens=900000):
-    """Load column descriptions from formatted output, optionally filtering to stay under token limit."""
-    descriptions_path = os.path.join(
-        os.path.dirname(os.path.abspath(__file__)),
-        "column_summaries", 
-        "formatted_output"
-    )
-    
+    """Load column descriptions from formatted output, optionally filtering to stay under token limit.
+
+    Memoized on the directory's mtime signature, so the glob/parse work runs
+    once per process unless the files change; callers must treat the
+    returned dict as read-only.
+    """
+    return _load_descriptions(_descriptions_mtime_sig(), max_tokens)
+
+
+def _parse_description_file(file_path):
+    """Read and decode one summary file; returns (path, data or None)."""
+    with open(file_path, 'rb') as f:
+        try:
+            return file_path, (orjson.loads(f.read()) if orjson is not None else json.load(f))
+        except ValueError:  # covers json and orjson decode errors
+            return file_path, None
+
+
+@functools.lru_cache(maxsize=4)
+def _load_descriptions(mtime_sig, max_tokens):
     descriptions = {}
     total_tokens = 0
     token_exceeded = False
-    
-    # Load all JSON files from the formatted output directory
-    json_files = glob.glob(os.path.join(descriptions_path, "*.json"))
-    
-    for file_path in json_files:
-        with open(file_path, 'r') as f:
-            try:
-                data = json.load(f)
-                column_name = data.get('name', os.path.basename(file_path).replace('.json', ''))
-                
-                # Create a compact description without histograms if we're approaching token limit
-                description = {
-                    "name": column_name,
-                    "purpose": data.get('Purpose', ''),
-                    "unique_values": data.get('Unique Values', '')
-                }
-                
-                # Only include full data if we're not close to the token limit
-                if not token_exceeded:
-                    description["histogram"] = data.get('Histogram', '')
-                    description["insights"] = data.get('Insights', '')
-                
-                # Estimate tokens (rough approximation: 1 token ~= 4 chars)
-                description_str = json.dumps(description)
-                est_tokens = len(description_str) // 4
-                total_tokens += est_tokens
-                
-                # If we're getting close to the limit, skip histograms for future entries
-                if total_tokens > max_tokens * 0.8:
-                    token_exceeded = True
-                
-                descriptions[column_name] = description
-                
-            except json.JSONDecodeError:
-                print(f"Error loading {file_path}")
-    
-    print(f"Loaded {len(descriptions)} column descriptions. Estimated tokens: {total_tokens}")
+
+    # Load all JSON files from the formatted output directory. The reads
+    # release the GIL, so a small pool overlaps the syscalls; the
+    # token-budget pass below stays serial because it is order-dependent.
+    json_files = glob.glob(os.path.join(_DESCRIPTIONS_DIR, "*.json"))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        parsed = list(executor.map(_parse_description_file, json_files))
+
+    for file_path, data in parsed:
+        if data is None:
+            logger.warning("Error loading %s", file_path)
+            continue
+
+        column_name = data.get('name', os.path.basename(file_path).replace('.json', ''))
+
+        # Create a compact description without histograms if we're approaching token limit
+        description = {
+            "name": column_name,
+            "purpose": data.get('Purpose', ''),
+            "unique_values": data.get('Unique Values', '')
+        }
+
+        # Only include full data if we're not close to the token limit
+        if not token_exceeded:
+            description["histogram"] = data.get('Histogram', '')
+            description["insights"] = data.get('Insights', '')
+
+        # Estimate tokens from field lengths (~4 chars/token) —
+        # serializing each description just to measure it was the
+        # dominant cost of this loop
+        est_tokens = sum(len(str(v)) for v in description.values()) // 4
+        total_tokens += est_tokens
+
+        # If we're getting close to the limit, skip histograms for future entries
+        if total_tokens > max_tokens * 0.8:
+            token_exceeded = True
+
+        descriptions[column_name] = description
+
+    logger.info("Loaded %d column descriptions. Estimated tokens: %d", len(descriptions), total_tokens)
     return descriptions
 
+def _column_descriptions_json(max_tokens=900000):
+    """Pretty-printed JSON blob of the column descriptions, serialized once per load.
+
+    sort_keys keeps the bytes stable across runs regardless of directory
+    enumeration order, which matters for provider-side prompt caching.
+    """
+    return _serialize_descriptions(_descriptions_mtime_sig(), max_tokens)
+
+
+@functools.lru_cache(maxsize=4)
+def _serialize_descriptions(mtime_sig, max_tokens):
+    return _json_dumps(_load_descriptions(mtime_sig, max_tokens), sort_keys=True)
+
+
+@functools.lru_cache(maxsize=1)
 def get_database_schema():
-    """Get the schema of the SQLite database."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    """Get the schema of the SQLite database (cached; the schema is static at runtime)."""
+    cursor = _get_conn().cursor()
     cursor.execute(f"PRAGMA table_info({TABLE_NAME})")
     schema = cursor.fetchall()
-    conn.close()
-    
+    cursor.close()
+
     # Format schema information
     schema_info = []
     for col in schema:
@@ -79,50 +226,128 @@ def get_database_schema():
     
     return schema_info
 
+@functools.lru_cache(maxsize=1)
+def _schema_columns():
+    """Lower-cased column names of the applications table."""
+    return frozenset(col.split(" ")[0].lower() for col in get_database_schema())
+
+
+# SQLite exposes the implicit rowid under any of these names
+_ROWID_NAMES = frozenset(("rowid", "oid", "_rowid_"))
+
+
+def _validate_sql(query):
+    """Parse the generated SQL with sqlglot and check its column references.
+
+    Returns an error string suitable for feeding back to the LLM, or None if
+    the query looks sound. Catching drift here is cheaper than a failed
+    cursor.execute and gives a clearer message than SQLite's parser.
+    """
+    try:
+        tree = sqlglot.parse_one(query, read="sqlite")
+    except sqlglot.errors.ParseError as e:
+        return f"SQL failed to parse: {e}"
+    known = _schema_columns() | _ROWID_NAMES
+    # SELECT aliases are legal in GROUP BY/ORDER BY, so don't flag them
+    aliases = {a.alias.lower() for a in tree.find_all(_sqlglot_exp.Alias) if a.alias}
+    # CTE/derived-table column lists (WITH t(x) AS ...) also name columns
+    for table_alias in tree.find_all(_sqlglot_exp.TableAlias):
+        aliases.update(col.name.lower() for col in table_alias.columns if col.name)
+    unknown = sorted({
+        col.name for col in tree.find_all(_sqlglot_exp.Column)
+        if col.name and col.name.lower() not in known and col.name.lower() not in aliases
+    })
+    if unknown:
+        return f"Unknown column(s): {', '.join(unknown)}"
+    return None
+
+
 def execute_query(query):
     """Execute the SQL query against the SQLite database."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
+    # Reject empty or stacked statements before touching the DB; the LLM
+    # occasionally emits trailing commentary or multiple statements.
+    if not _is_single_statement(query):
+        return {"success": False, "results": None, "error": "Expected exactly one SQL statement"}
+
+    if sqlglot is not None:
+        error = _validate_sql(query)
+        if error is not None:
+            return {"success": False, "results": None, "error": error}
+
+    # Defensively cap uncapped SELECTs. The fetch loop below already stops at
+    # MAX_RESULT_ROWS, but an explicit LIMIT lets SQLite quit producing rows
+    # early instead of us discarding them.
+    query = query.strip().rstrip(";")
+    if query[:6].upper() == "SELECT" and not _LIMIT_RE.search(query):
+        query = f"{query} LIMIT {MAX_RESULT_ROWS}"
+
+    cursor = _get_conn().cursor()
+
     try:
+        cursor.arraysize = 256
         cursor.execute(query)
         columns = [description[0] for description in cursor.description]
-        results = cursor.fetchall()
-        
-        # Format results as a list of dictionaries
-        formatted_results = [dict(zip(columns, row)) for row in results]
-        return {"success": True, "results": formatted_results, "count": len(formatted_results)}
-    
+
+        # Fetch in batches so a runaway result set never fully materializes;
+        # stop at MAX_RESULT_ROWS and flag the truncation. Rows stay as the
+        # tuples sqlite hands back — per-row dicts would double memory for
+        # wide results, and consumers only need them at serialization time.
+        rows = []
+        truncated = False
+        while True:
+            batch = cursor.fetchmany()
+            if not batch:
+                break
+            rows.extend(batch)
+            if len(rows) >= MAX_RESULT_ROWS:
+                del rows[MAX_RESULT_ROWS:]
+                truncated = True
+                break
+        result = {"success": True, "columns": columns, "rows": rows, "count": len(rows)}
+        if truncated:
+            result["truncated"] = True
+        return result
+
     except Exception as e:
         return {"success": False, "results": None, "error": str(e)}
-    
+
     finally:
-        conn.close()
+        cursor.close()
 
-def process_natural_language_query(nl_query):
-    """Process a natural language query and return the results."""
-    # Load column descriptions
-    column_descriptions = load_column_descriptions()
-    
-    # Get database schema
-    schema_info = get_database_schema()
-    
-    # Get environmental variable containing the prompt template
-    sql_query_prompt = os.getenv("SQL_QUERY_PROMPT")
-    
-    # Fill the prompt template with our data
-    prompt = sql_query_prompt.format(
-        nl_query=nl_query,
+def _sql_prompt_parts():
+    """Render the SQL prompt template once and split it at the {nl_query} slot.
+
+    The static fields (table name, schema, column descriptions) dominate the
+    template and sit before the query, so filling them once and keeping them
+    in a byte-identical system message lets Azure OpenAI's prefix cache hit
+    on every turn; only the short user message varies. Re-rendered if the
+    description files change.
+    """
+    return _render_prompt_parts(_descriptions_mtime_sig())
+
+
+@functools.lru_cache(maxsize=4)
+def _render_prompt_parts(mtime_sig):
+    filled = os.getenv("SQL_QUERY_PROMPT").format(
+        nl_query="\x00",
         table_name=TABLE_NAME,
-        schema=", ".join(schema_info),
-        column_descriptions=json.dumps(column_descriptions, indent=2)
+        schema=", ".join(get_database_schema()),
+        column_descriptions=_column_descriptions_json(),
     )
-    
-    # Call the LLM
-    response = call_llm(prompt)
+    prefix, _, suffix = filled.partition("\x00")
+    return prefix, suffix
+
+
+def process_natural_language_query(nl_query):
+    """Process a natural language query and return the results."""
+    system_prompt, user_suffix = _sql_prompt_parts()
+
+    # Call the LLM: static prefix in the system message, only the user turn
+    # changes per call
+    response = call_llm(nl_query + user_suffix, system_prompt=system_prompt)
     
     # Extract SQL query from the response
-    sql_match = re.search(r"```sql\n(.*?)\n```", response, re.DOTALL)
+    sql_match = _SQL_BLOCK_RE.search(response)
     if sql_match:
         sql_query = sql_match.group(1)
         # Execute the SQL query
@@ -139,48 +364,90 @@ def process_natural_language_query(nl_query):
             "full_response": response
         }
 
+# Exact-match LRU of recent NL-query results. Conversational flows repeat
+# near-identical questions; a hit skips both the LLM round-trip and the
+# SQLite execution. Only successful lookups are cached.
+_ANSWER_CACHE = collections.OrderedDict()
+_ANSWER_CACHE_MAX = 256
+
+_WS_RE = re.compile(r"\s+")
+
+
+def _cache_key(nl_query):
+    """Normalize the query for cache lookup: casing, whitespace runs and
+    trailing punctuation don't change the question being asked. The database
+    mtime rides along as an epoch so a reloaded database invalidates every
+    cached answer; the prompt template is fixed for the life of the process.
+    """
+    normalized = _WS_RE.sub(" ", nl_query.strip().lower()).rstrip("?!. ")
+    try:
+        db_epoch = os.path.getmtime(DB_FILE)
+    except OSError:
+        db_epoch = 0.0
+    return (normalized, db_epoch)
+
+
+def _cache_answer(key, result):
+    if len(_ANSWER_CACHE) >= _ANSWER_CACHE_MAX:
+        _ANSWER_CACHE.popitem(last=False)
+    _ANSWER_CACHE[key] = result
+
+
 def get_sql_and_answer(nl_query):
     """
     Given a natural language query, return (sql_query, sql_answer_str)
     """
+    cache_key = _cache_key(nl_query)
+    cached = _ANSWER_CACHE.get(cache_key)
+    if cached is not None:
+        _ANSWER_CACHE.move_to_end(cache_key)
+        return cached
+
     result = process_natural_language_query(nl_query)
-    # Print the raw LLM response for debugging
+    # Log the raw LLM response for debugging; %s interpolation is lazy, so
+    # nothing is formatted unless DEBUG is enabled
     if 'full_response' in result:
-        print("[DEBUG] Raw LLM response:\n", result['full_response'])
+        logger.debug("Raw LLM response:\n%s", result['full_response'])
     elif 'sql' not in result and 'error' in result:
-        print("[DEBUG] SQL generation error:", result['error'])
+        logger.debug("SQL generation error: %s", result['error'])
 
     sql_query = None
     # Try to extract SQL robustly
     if 'sql' in result:
         sql_query = result['sql']
     elif 'full_response' in result:
-        import re
-        # Try to extract from ```sql ... ```
-        match = re.search(r"```sql\s*(.*?)\s*```", result['full_response'], re.DOTALL | re.IGNORECASE)
+        # Single pass: matches a ```sql ... ``` block or a bare SELECT
+        # statement, whichever appears first in the response
+        match = _SQL_ANY_RE.search(result['full_response'])
         if match:
-            sql_query = match.group(1).strip()
-            print("[DEBUG] Extracted SQL from code block:", sql_query)
+            sql_query = (match.group('block') or match.group('select')).strip()
+            logger.debug("Extracted SQL from fallback scan: %s", sql_query)
         else:
-            # Fallback: try to find first SELECT statement
-            match = re.search(r"(SELECT[\s\S]+?;)", result['full_response'], re.IGNORECASE)
-            if match:
-                sql_query = match.group(1).strip()
-                print("[DEBUG] Extracted SQL from SELECT fallback:", sql_query)
-            else:
-                print("[DEBUG] Could not extract SQL from LLM response.")
-                sql_query = ""
+            logger.debug("Could not extract SQL from LLM response.")
+            sql_query = ""
     else:
         sql_query = ""
 
     # Format the answer as a string (customize as needed)
     if 'results' in result and result['results']['success']:
-        sql_answer = json.dumps(result['results']['results'], indent=2)
-        print("[DEBUG] Generated SQL Query:\n", sql_query)
-        print("[DEBUG] SQL Answer/Response:\n", sql_answer)
+        res = result['results']
+        if res['count'] > 100:
+            # Columnar shape for large results — no repeated keys per row,
+            # so the serialized answer (and the prompt it feeds) shrinks by
+            # roughly the column names times the row count
+            sql_answer = _json_dumps({"columns": res['columns'], "rows": res['rows']})
+        else:
+            # Row dicts are built once here, straight into the serializer input
+            sql_answer = _json_dumps(
+                [dict(zip(res['columns'], row)) for row in res['rows']]
+            )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Generated SQL Query:\n%s", sql_query)
+            logger.debug("SQL Answer/Response:\n%s", sql_answer)
+        _cache_answer(cache_key, (sql_query, sql_answer))
         return sql_query, sql_answer
     else:
-        print("[DEBUG] SQL generation or execution failed:", result.get('error', 'Unknown error'))
+        logger.debug("SQL generation or execution failed: %s", result.get('error', 'Unknown error'))
         return sql_query or "", f"Error: {result.get('error', 'Unknown error')}"
 
 if __name__ == "__main__":
@@ -234,10 +501,11 @@ if __name__ == "__main__":
         
         print("\nQuery Results:")
         if result["results"]["success"]:
-            print(f"Found {result['results']['count']} results")
-            for i, row in enumerate(result["results"]["results"]):
+            res = result["results"]
+            print(f"Found {res['count']} results")
+            for i, row in enumerate(res["rows"]):
                 if i < 10:  # Limit to first 10 results for readability
-                    print(row)
+                    print(dict(zip(res["columns"], row)))
                 elif i == 10:
                     print("... (more results available)")
         else:
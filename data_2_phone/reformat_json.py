@@ -1,7 +1,15 @@
+import logging
 import os
 import json
 import re
 
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json works everywhere
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
 # Paths
 INPUT_FOLDER = os.path.join(
     "/Users/kanavkahol/work/data_2_phone", "preprocessing", "column_summaries"
@@ -10,41 +18,34 @@ OUTPUT_FOLDER = os.path.join(
     "/Users/kanavkahol/work/data_2_phone", "preprocessing", "column_summaries", "formatted_output"
 )
 
+# One C-level scan per name: every ASCII character outside [\w\-.] maps to
+# an underscore (non-ASCII word characters pass through, as with \w)
+_FN_TABLE = {c: "_" for c in range(128) if not (chr(c).isalnum() or chr(c) in "_-.")}
+_UNDERSCORE_RUN_RE = re.compile(r"_+")
+
+# All section markers as one alternation, so each file's content is scanned
+# a single time instead of once per marker
+_SECTION_RE = re.compile(
+    r"\*\*(?:Purpose|Unique Values|Histogram[^*]*|Conclusion|Summary|Insights):\*\*"
+)
+
 def sanitize_filename(filename):
     """Sanitize filenames by removing extra spaces and replacing invalid characters."""
-    sanitized = re.sub(r"[^\w\-.]", "_", filename.strip())  # Replace invalid characters with underscores
-    sanitized = re.sub(r"_+", "_", sanitized)  # Replace multiple underscores with a single underscore
-    return sanitized
+    sanitized = filename.strip().translate(_FN_TABLE)  # Replace invalid characters with underscores
+    return _UNDERSCORE_RUN_RE.sub("_", sanitized)  # Replace multiple underscores with a single underscore
 
 def reformat_json(file_path):
     """Reformat the JSON structure."""
-    with open(file_path, "r") as f:
-        data = json.load(f)
+    with open(file_path, "rb") as f:
+        data = orjson.loads(f.read()) if orjson is not None else json.load(f)
 
     # Extract the column name (key) and its content
     column_name, content = next(iter(data.items()))
 
-    # Define section boundaries and patterns
-    section_markers = [
-        r"\*\*Purpose:\*\*", 
-        r"\*\*Unique Values:\*\*", 
-        r"\*\*Histogram.*?:\*\*",
-        r"\*\*Histogram Summary:\*\*",
-        r"\*\*Conclusion:\*\*",
-        r"\*\*Summary:\*\*",
-        r"\*\*Insights:\*\*"
-    ]
-    
-    # Find all section starts
-    section_positions = []
-    for marker in section_markers:
-        matches = list(re.finditer(marker, content, re.DOTALL))
-        for match in matches:
-            section_positions.append((match.start(), match.group()))
-    
-    # Sort by position
-    section_positions.sort()
-    
+    # Find all section starts in one pass; finditer yields matches in
+    # document order, so no sort is needed
+    section_positions = [(m.start(), m.group()) for m in _SECTION_RE.finditer(content)]
+
     # Extract content between sections
     sections = {}
     for i, (pos, section_name) in enumerate(section_positions):
@@ -80,55 +81,56 @@ def reformat_json(file_path):
 def process_files(input_folder, output_folder):
     """Process all JSON files in the input folder and save reformatted files to the output folder."""
     absolute_input_folder = os.path.abspath(input_folder)
-    print(f"Resolved absolute input folder path: {absolute_input_folder}")
+    logger.debug("Resolved absolute input folder path: %s", absolute_input_folder)
 
     if not os.path.exists(absolute_input_folder):
-        print(f"Input folder does not exist: {absolute_input_folder}")
+        logger.error("Input folder does not exist: %s", absolute_input_folder)
         return
-    else:
-        print(f"Input folder exists: {absolute_input_folder}")
-        print("Files in input folder:")
-        for file_name in os.listdir(absolute_input_folder):
-            print(file_name)
 
     os.makedirs(output_folder, exist_ok=True)
 
     files_processed = 0
-    print(f"Scanning input folder: {absolute_input_folder}")
-    for file_name in os.listdir(absolute_input_folder):
-        input_file_path = os.path.join(absolute_input_folder, file_name)
-
-        # Skip directories and non-JSON files
-        if not os.path.isfile(input_file_path) or not file_name.endswith(".json"):
-            print(f"Skipping: {file_name} (not a valid JSON file)")
+    logger.info("Scanning input folder: %s", absolute_input_folder)
+    # scandir caches the file type on each DirEntry, so no stat per entry
+    with os.scandir(absolute_input_folder) as entries:
+        files = [(entry.name, entry.path) for entry in entries if entry.is_file()]
+    for file_name, input_file_path in files:
+        # Skip non-JSON files
+        if not file_name.endswith(".json"):
+            logger.debug("Skipping: %s (not a valid JSON file)", file_name)
             continue
 
         sanitized_file_name = sanitize_filename(file_name)
         output_file_path = os.path.join(output_folder, sanitized_file_name)
 
-        print(f"Processing file: {file_name} (sanitized to {sanitized_file_name})...")
+        logger.debug("Processing file: %s (sanitized to %s)...", file_name, sanitized_file_name)
 
         try:
             # Reformat the JSON content
             reformatted_data = reformat_json(input_file_path)
 
-            # Save the reformatted JSON
-            with open(output_file_path, "w") as f:
-                json.dump(reformatted_data, f, indent=4)
+            # Save the reformatted JSON (orjson encodes in one C pass)
+            if orjson is not None:
+                with open(output_file_path, "wb") as f:
+                    f.write(orjson.dumps(reformatted_data, option=orjson.OPT_INDENT_2))
+            else:
+                with open(output_file_path, "w") as f:
+                    json.dump(reformatted_data, f, indent=4)
 
-            print(f"Reformatted file saved to: {output_file_path}")
+            logger.debug("Reformatted file saved to: %s", output_file_path)
             files_processed += 1
         except Exception as e:
-            print(f"Error processing file {file_name}: {e}")
+            logger.warning("Error processing file %s: %s", file_name, e)
 
     if files_processed == 0:
-        print("No JSON files were processed. Ensure the input folder contains valid JSON files.")
+        logger.warning("No JSON files were processed. Ensure the input folder contains valid JSON files.")
     else:
-        print(f"Total files processed: {files_processed}")
+        logger.info("Total files processed: %d", files_processed)
 
 def main():
-    print(f"Input folder: {os.path.abspath(INPUT_FOLDER)}")
-    print(f"Output folder: {os.path.abspath(OUTPUT_FOLDER)}")
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Input folder: %s", os.path.abspath(INPUT_FOLDER))
+    logger.info("Output folder: %s", os.path.abspath(OUTPUT_FOLDER))
     process_files(INPUT_FOLDER, OUTPUT_FOLDER)
 
 if __name__ == "__main__":
@@ -201,10 +201,10 @@ function App() {
     }
   };
 
-  const playAudioResponse = (audioHex: string) => {
+  const playAudioResponse = (audioBase64: string) => {
     setStatus('speaking');
-    // Convert hex to binary
-    const binary = new Uint8Array(audioHex.match(/.{1,2}/g)!.map(byte => parseInt(byte, 16)));
+    // Convert base64 to binary
+    const binary = Uint8Array.from(atob(audioBase64), char => char.charCodeAt(0));
     const blob = new Blob([binary], { type: 'audio/wav' });
     const url = URL.createObjectURL(blob);
 